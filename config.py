@@ -6,12 +6,15 @@ Edit this file to set your IBKR credentials, watchlist, and notification prefere
 import os
 from pathlib import Path
 
-# Load .env if available
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+# Load .env if available. Point dotenv at the project file directly so it does not
+# walk the call stack and parent directories searching for one on every import.
+_ENV_FILE = Path(__file__).parent / ".env"
+if _ENV_FILE.is_file():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(_ENV_FILE)
+    except ImportError:
+        pass
 
 # ============== IBKR Connection ==============
 IBKR_HOST = os.getenv("IBKR_HOST", "127.0.0.1")
@@ -53,6 +56,9 @@ MARKET_INDICATORS = ["SPY", "QQQ"]
 # Scan interval in minutes (how often to refresh scanner data)
 SCAN_INTERVAL_MINUTES = int(os.getenv("SCAN_INTERVAL_MINUTES", "15"))
 
+# Reuse historical bars fetched within this many seconds (0 disables)
+BARS_CACHE_TTL_SECONDS = int(os.getenv("BARS_CACHE_TTL_SECONDS", "60"))
+
 # ============== Report Schedule ==============
 # Times for daily reports (24h format, local timezone)
 REPORT_TIMES = ["08:00", "20:00"]  # 8am and 8pm
@@ -3,17 +3,35 @@ IBKR (Interactive Brokers) connection module using ib_async.
 Handles connection, historical data fetching, and order placement.
 """
 
+import asyncio
+import atexit
+import functools
 import logging
-from typing import Optional
+import time
+from contextlib import contextmanager
+from typing import Optional, Iterable
 
-from ib_async import IB, Stock, util, BarData
+import numpy as np
+from ib_async import IB, Stock, BarData
 
 import config
 
 logger = logging.getLogger(__name__)
 
+# IBKR allows up to 50 simultaneous open historical data requests.
+MAX_CONCURRENT_HISTORICAL_REQUESTS = 50
+
+# Upper bound on the number of cached (symbol, timeframe) bar series.
+BARS_CACHE_MAX_ENTRIES = 256
+
+# How long the heartbeat waits for TWS to answer its round-trip probe.
+HEARTBEAT_TIMEOUT_SECONDS = 10
+
 _ib_instance: Optional[IB] = None
 
+# (symbol, duration, bar_size, use_rth) -> (monotonic fetch time, bars)
+_bars_cache: dict[tuple, tuple[float, list[BarData]]] = {}
+
 
 def get_connection() -> IB:
     """Get or create IBKR connection."""
@@ -50,11 +68,104 @@ def disconnect():
     _ib_instance = None
 
 
+def ensure_connected() -> bool:
+    """
+    Make sure the long-lived connection is up, reconnecting if TWS dropped it.
+    A dropped IB instance is discarded so the reconnect starts from clean state.
+    """
+    global _ib_instance
+    ib = _ib_instance
+    if ib is not None and not (ib.isConnected() and ib.client.isConnected()):
+        ib.disconnect()
+        _ib_instance = None
+    return connect()
+
+
+def heartbeat() -> bool:
+    """
+    Probe the long-lived connection with a round trip to TWS, reconnecting if it fails.
+
+    Nothing runs the IB event loop between requests, so a TWS/Gateway restart is not
+    noticed (and its messages pile up unread) until something does; the probe runs the
+    loop, and a dead socket that still reports connected fails to answer it.
+    """
+    global _ib_instance
+    ib = _ib_instance
+    if ib is not None and ib.isConnected():
+        try:
+            ib.run(asyncio.wait_for(ib.reqCurrentTimeAsync(), HEARTBEAT_TIMEOUT_SECONDS))
+        except Exception as e:
+            logger.warning(f"IBKR heartbeat got no answer, reconnecting: {e}")
+            ib.disconnect()
+            _ib_instance = None
+    return ensure_connected()
+
+
+# The connection is kept open for the life of the process; close it on exit.
+atexit.register(disconnect)
+
+
+@contextmanager
+def session():
+    """
+    Use the shared, persistent IBKR connection.
+
+    Reconnects on entry if needed and leaves the connection open on exit, so
+    scheduler ticks and the parts of a report (scan, positions, strategy) all reuse
+    one TWS session instead of renegotiating it. Yields whether the connection is up.
+    """
+    yield ensure_connected()
+
+
+@functools.lru_cache(maxsize=512)
 def get_stock_contract(symbol: str) -> Stock:
-    """Create a Stock contract for US equities."""
+    """Create a Stock contract for US equities (cached per symbol)."""
     return Stock(symbol, "SMART", "USD")
 
 
+def qualify_contracts(symbols: Iterable[str]) -> int:
+    """
+    Resolve the cached contracts for symbols up front.
+
+    Qualification fills in conId/exchange details on the shared Stock objects, so
+    later data requests and orders skip contract resolution. Returns the number
+    of contracts qualified.
+    """
+    contracts = [get_stock_contract(symbol) for symbol in dict.fromkeys(symbols)]
+    if not contracts:
+        return 0
+    with session() as connected:
+        if not connected:
+            return 0
+        try:
+            qualified = get_connection().qualifyContracts(*contracts)
+        except Exception as e:
+            logger.warning(f"Failed to qualify contracts: {e}")
+            return 0
+    return len(qualified)
+
+
+def _get_cached_bars(key: tuple) -> Optional[list[BarData]]:
+    entry = _bars_cache.get(key)
+    if entry and time.monotonic() - entry[0] < config.BARS_CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+
+def _put_cached_bars(key: tuple, bars: Optional[list[BarData]]) -> None:
+    # Failures and empty results are not cached so they are retried next time.
+    if not bars or config.BARS_CACHE_TTL_SECONDS <= 0:
+        return
+    now = time.monotonic()
+    _bars_cache.pop(key, None)
+    _bars_cache[key] = (now, bars)
+    if len(_bars_cache) > BARS_CACHE_MAX_ENTRIES:
+        for k in [k for k, (t, _) in _bars_cache.items() if now - t >= config.BARS_CACHE_TTL_SECONDS]:
+            del _bars_cache[k]
+        while len(_bars_cache) > BARS_CACHE_MAX_ENTRIES:
+            del _bars_cache[next(iter(_bars_cache))]
+
+
 def fetch_historical_bars(
     symbol: str,
     duration: str = "1 M",
@@ -72,7 +183,14 @@ def fetch_historical_bars(
     
     Returns:
         List of BarData or None on failure
+
+    Bars fetched within the last BARS_CACHE_TTL_SECONDS are reused.
     """
+    key = (symbol, duration, bar_size, use_rth)
+    cached = _get_cached_bars(key)
+    if cached is not None:
+        return cached
+
     ib = get_connection()
     if not ib.isConnected():
         if not connect():
@@ -88,17 +206,105 @@ def fetch_historical_bars(
             whatToShow="TRADES",
             useRTH=use_rth,
         )
+        _put_cached_bars(key, bars)
         return bars
     except Exception as e:
         logger.error(f"Failed to fetch bars for {symbol}: {e}")
         return None
 
 
-def bars_to_dataframe(bars: list[BarData]):
-    """Convert BarData list to pandas DataFrame."""
+async def fetch_historical_bars_async(
+    symbol: str,
+    duration: str = "1 M",
+    bar_size: str = "1 day",
+    use_rth: bool = True,
+) -> Optional[list[BarData]]:
+    """
+    Async variant of fetch_historical_bars, so many symbols can be requested concurrently.
+
+    The caller must already be connected (connect() blocks on the event loop and
+    cannot be used from inside a coroutine).
+    """
+    ib = get_connection()
+    if not ib.isConnected():
+        logger.error(f"Failed to fetch bars for {symbol}: not connected to IBKR")
+        return None
+
+    try:
+        contract = get_stock_contract(symbol)
+        bars = await ib.reqHistoricalDataAsync(
+            contract,
+            endDateTime="",
+            durationStr=duration,
+            barSizeSetting=bar_size,
+            whatToShow="TRADES",
+            useRTH=use_rth,
+        )
+        return bars
+    except Exception as e:
+        logger.error(f"Failed to fetch bars for {symbol}: {e}")
+        return None
+
+
+def fetch_historical_bars_batch(
+    symbols: Iterable[str],
+    duration: str = "1 M",
+    bar_size: str = "1 day",
+    use_rth: bool = True,
+) -> dict[str, Optional[list[BarData]]]:
+    """
+    Fetch historical bars for many symbols sharing the same duration/bar size.
+
+    Requests run concurrently, at most MAX_CONCURRENT_HISTORICAL_REQUESTS at a time.
+    Symbols fetched within the last BARS_CACHE_TTL_SECONDS are served from the
+    cache. Returns a dict of symbol -> bars (None for symbols that failed).
+    """
+    symbols = list(dict.fromkeys(symbols))
+    result = {s: _get_cached_bars((s, duration, bar_size, use_rth)) for s in symbols}
+    missing = [s for s in symbols if result[s] is None]
+    if not missing:
+        return result
+
+    ib = get_connection()
+    if not ib.isConnected():
+        if not connect():
+            return result
+
+    async def _fetch_all():
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_HISTORICAL_REQUESTS)
+
+        async def _fetch(symbol: str):
+            async with semaphore:
+                return await fetch_historical_bars_async(
+                    symbol, duration=duration, bar_size=bar_size, use_rth=use_rth
+                )
+
+        return await asyncio.gather(*[_fetch(symbol) for symbol in missing])
+
+    for symbol, bars in zip(missing, ib.run(_fetch_all())):
+        _put_cached_bars((symbol, duration, bar_size, use_rth), bars)
+        result[symbol] = bars
+    return result
+
+
+def bars_to_arrays(bars: list[BarData]) -> Optional[dict[str, np.ndarray]]:
+    """
+    Convert BarData list to NumPy arrays keyed by field (close, high, low, volume),
+    skipping DataFrame construction.
+
+    Prices are float32: indicators are only shown to a few decimals, and halving the
+    array size halves memory traffic in the indicator passes. Volume stays float64
+    since share counts exceed float32's exact integer range.
+    """
     if not bars:
         return None
-    return util.df(bars)
+    n = len(bars)
+    arrays = {
+        name: np.fromiter((getattr(b, name) for b in bars), dtype=np.float32, count=n)
+        for name in ("close", "high", "low")
+    }
+    arrays["volume"] = np.fromiter((b.volume for b in bars), dtype=np.float64, count=n)
+    return arrays
 
 
 def place_market_order(symbol: str, action: str, quantity: int):
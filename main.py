@@ -11,24 +11,33 @@ Usage:
 
 import logging
 import sys
-from pathlib import Path
 
 import config
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(config.LOG_DIR / "bot.log", encoding="utf-8"),
-    ],
-)
 logger = logging.getLogger(__name__)
 
+COMMANDS = ("scan", "strategy", "report", "scheduler")
+
+
+def _configure_logging():
+    """Set up console + file logging (deferred so usage output doesn't touch the log file)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler(config.LOG_DIR / "bot.log", encoding="utf-8"),
+        ],
+    )
+
 
 def main():
     cmd = sys.argv[1].lower() if len(sys.argv) > 1 else "scheduler"
+    if cmd not in COMMANDS:
+        print(__doc__)
+        sys.exit(1)
+
+    _configure_logging()
 
     if cmd == "scan":
         from market_scanner import run_scanner
@@ -55,10 +64,6 @@ def main():
 
         start_scheduler()
 
-    else:
-        print(__doc__)
-        sys.exit(1)
-
 
 if __name__ == "__main__":
     main()
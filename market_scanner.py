@@ -4,19 +4,44 @@ Runs automatically on a schedule and provides data for reports.
 """
 
 import logging
-from dataclasses import dataclass, field
+import math
+import time
+from dataclasses import dataclass, field, asdict
 from datetime import datetime
 from typing import Optional, Iterable
 
-import pandas as pd
 import numpy as np
 
+# Optional: JIT-compile the indicator kernels if numba is installed
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+# Optional: use TA-Lib's C implementations of the indicators if installed
+try:
+    import talib
+    _HAS_TALIB = True
+except ImportError:
+    _HAS_TALIB = False
+
 import config
-from ibkr_connection import connect, disconnect, fetch_historical_bars, bars_to_dataframe
-from sma_strategy import _get_sma_settings
+from ibkr_connection import (
+    session,
+    fetch_historical_bars_batch,
+    bars_to_arrays,
+)
+from sma_strategy import SmaSettings, _get_sma_settings
 
 logger = logging.getLogger(__name__)
 
+# Latest scan results, reused by on-demand reports generated within
+# SCAN_INTERVAL_MINUTES (scheduled reports always scan fresh).
+SNAPSHOT_CACHE_FILE = config.DATA_DIR / "_snapshot_cache.parquet"
+
 
 @dataclass
 class StockIndicators:
@@ -43,45 +68,100 @@ class MarketSnapshot:
     errors: list[str] = field(default_factory=list)
 
 
-def compute_rsi(series: pd.Series, period: int = 14) -> float:
-    """Compute RSI (Relative Strength Index)."""
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0.0)
-    loss = (-delta).where(delta < 0, 0.0)
-    avg_gain = gain.rolling(window=period).mean()
-    avg_loss = loss.rolling(window=period).mean()
-    rs = avg_gain / avg_loss.replace(0, np.nan)
-    rsi = 100 - (100 / (1 + rs))
-    return float(rsi.iloc[-1]) if not pd.isna(rsi.iloc[-1]) else 50.0
+@njit(cache=True, fastmath=True)
+def _wilder_kernel(gain: np.ndarray, loss: np.ndarray, period: int):
+    """Seed with a simple average, then apply Wilder's recursive smoothing."""
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(period):
+        avg_gain += float(gain[i])
+        avg_loss += float(loss[i])
+    avg_gain /= period
+    avg_loss /= period
+    for i in range(period, len(gain)):
+        avg_gain = (avg_gain * (period - 1) + float(gain[i])) / period
+        avg_loss = (avg_loss * (period - 1) + float(loss[i])) / period
+    return avg_gain, avg_loss
+
+
+def compute_rsi(close_arr: np.ndarray, period: int = 14) -> float:
+    """Compute RSI (Relative Strength Index) using Wilder's smoothing."""
+    if len(close_arr) <= period:
+        return 50.0
+    if _HAS_TALIB:
+        rsi = float(talib.RSI(close_arr.astype(np.float64), timeperiod=period)[-1])
+        return 50.0 if math.isnan(rsi) else rsi
+    delta = np.diff(close_arr)
+    gain = np.maximum(delta, 0)
+    loss = np.maximum(-delta, 0)
+    avg_gain, avg_loss = _wilder_kernel(gain, loss, period)
+
+    if math.isnan(avg_gain) or math.isnan(avg_loss):
+        return 50.0
+    if avg_loss == 0:
+        return 100.0 if avg_gain > 0 else 50.0
+    rs = avg_gain / avg_loss
+    return float(100 - (100 / (1 + rs)))
+
+
+@njit(cache=True, fastmath=True)
+def _macd_kernel(close: np.ndarray, fast: int, slow: int, signal: int):
+    """
+    Single pass over close, tracking the three EMAs as float64 scalars
+    (matches ewm(adjust=False)).
+    """
+    alpha_fast = 2.0 / (fast + 1)
+    alpha_slow = 2.0 / (slow + 1)
+    alpha_signal = 2.0 / (signal + 1)
+    ema_fast = float(close[0])
+    ema_slow = float(close[0])
+    macd_signal = 0.0
+    for i in range(1, len(close)):
+        price = float(close[i])
+        ema_fast += alpha_fast * (price - ema_fast)
+        ema_slow += alpha_slow * (price - ema_slow)
+        macd_signal += alpha_signal * ((ema_fast - ema_slow) - macd_signal)
+    macd_line = ema_fast - ema_slow
+    return macd_line, macd_signal, macd_line - macd_signal
 
 
 def compute_macd(
-    series: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9
+    close_arr: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9
 ) -> tuple[float, float, float]:
     """Compute MACD line, signal line, and histogram."""
-    ema_fast = series.ewm(span=fast, adjust=False).mean()
-    ema_slow = series.ewm(span=slow, adjust=False).mean()
-    macd_line = ema_fast - ema_slow
-    macd_signal = macd_line.ewm(span=signal, adjust=False).mean()
-    macd_hist = macd_line - macd_signal
+    if len(close_arr) == 0:
+        return 0.0, 0.0, 0.0
+    if _HAS_TALIB:
+        # TA-Lib seeds each EMA with an SMA, so early bars differ slightly from ewm().
+        line, sig, hist = talib.MACD(
+            close_arr.astype(np.float64), fastperiod=fast, slowperiod=slow, signalperiod=signal
+        )
+        macd_line, macd_signal, macd_hist = float(line[-1]), float(sig[-1]), float(hist[-1])
+    else:
+        macd_line, macd_signal, macd_hist = _macd_kernel(close_arr, fast, slow, signal)
     return (
-        float(macd_line.iloc[-1]) if not pd.isna(macd_line.iloc[-1]) else 0.0,
-        float(macd_signal.iloc[-1]) if not pd.isna(macd_signal.iloc[-1]) else 0.0,
-        float(macd_hist.iloc[-1]) if not pd.isna(macd_hist.iloc[-1]) else 0.0,
+        0.0 if math.isnan(macd_line) else float(macd_line),
+        0.0 if math.isnan(macd_signal) else float(macd_signal),
+        0.0 if math.isnan(macd_hist) else float(macd_hist),
     )
 
 
-def compute_atr(df: pd.DataFrame, period: int = 14) -> float:
+def compute_atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> float:
     """Compute Average True Range."""
-    high = df["high"]
-    low = df["low"]
-    close = df["close"]
-    tr1 = high - low
-    tr2 = abs(high - close.shift(1))
-    tr3 = abs(low - close.shift(1))
-    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-    atr = tr.rolling(window=period).mean()
-    return float(atr.iloc[-1]) if not pd.isna(atr.iloc[-1]) else 0.0
+    if len(close) < period:
+        return 0.0
+    if _HAS_TALIB:
+        tr = talib.TRANGE(high.astype(np.float64), low.astype(np.float64), close.astype(np.float64))
+    else:
+        prev_close = np.empty_like(close)
+        prev_close[0] = np.nan
+        prev_close[1:] = close[:-1]
+        tr = np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    # Simple mean of the last `period` true ranges (not TA-Lib's Wilder-smoothed ATR).
+    window = tr[-period:]
+    if np.isnan(window).all():
+        return 0.0
+    return float(np.nanmean(window, dtype=np.float64))
 
 
 def get_trend(sma_20: float, sma_50: float, rsi: float) -> str:
@@ -93,15 +173,41 @@ def get_trend(sma_20: float, sma_50: float, rsi: float) -> str:
     return "neutral"
 
 
-def scan_symbol(symbol: str, strategy_type: Optional[str] = None) -> Optional[StockIndicators]:
-    """Compute indicators for a single symbol."""
-    # Align scanner timeframe with SMA strategy settings so prices/SMA context match.
-    settings = _get_sma_settings(strategy_type)
-    bars = fetch_historical_bars(
-        symbol,
-        duration=settings["duration"],
-        bar_size=settings["bar_size"],
-    )
+def _indicators(
+    close: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    vol: Optional[np.ndarray],
+    price: Optional[float] = None,
+) -> dict:
+    """
+    Compute all scalar indicators the scanner reports from the raw price arrays.
+    Only the latest value of each indicator is needed, so SMAs are tail means
+    rather than full rolling series. Prices may be float32; reductions accumulate
+    in float64. Pass price (the exact last close) to report it without float32
+    rounding noise, since it is also shown unformatted in the market summary.
+    """
+    n = len(close)
+    if price is None:
+        price = float(close[-1])
+    volume = int(vol[-1]) if vol is not None else 0
+    macd_line, macd_signal, macd_hist = compute_macd(close)
+    return {
+        "price": price,
+        "sma_20": float(close[-20:].mean(dtype=np.float64)) if n >= 20 else price,
+        "sma_50": float(close[-50:].mean(dtype=np.float64)) if n >= 50 else price,
+        "rsi_14": compute_rsi(close, 14),
+        "macd_line": macd_line,
+        "macd_signal": macd_signal,
+        "macd_histogram": macd_hist,
+        "volume": volume,
+        "volume_sma_20": float(vol[-20:].mean()) if vol is not None and n >= 20 else volume,
+        "atr_14": compute_atr(high, low, close, 14),
+    }
+
+
+def _indicators_from_bars(symbol: str, bars) -> StockIndicators:
+    """Build the StockIndicators for a symbol from its fetched bars."""
     if not bars:
         return StockIndicators(
             symbol=symbol,
@@ -119,8 +225,8 @@ def scan_symbol(symbol: str, strategy_type: Optional[str] = None) -> Optional[St
             error="Failed to fetch data",
         )
 
-    df = bars_to_dataframe(bars)
-    if df is None or len(df) < 50:
+    arrays = bars_to_arrays(bars)
+    if arrays is None or len(arrays["close"]) < 50:
         return StockIndicators(
             symbol=symbol,
             price=0,
@@ -137,57 +243,133 @@ def scan_symbol(symbol: str, strategy_type: Optional[str] = None) -> Optional[St
             error="Insufficient data",
         )
 
-    close = df["close"]
-    latest = df.iloc[-1]
-    price = float(latest["close"])
-    volume = int(latest["volume"]) if "volume" in df.columns else 0
+    close = arrays["close"]
+    high = arrays["high"]
+    low = arrays["low"]
+    vol = arrays["volume"]
 
-    sma_20 = float(close.rolling(20).mean().iloc[-1]) if len(df) >= 20 else price
-    sma_50 = float(close.rolling(50).mean().iloc[-1]) if len(df) >= 50 else price
-    rsi = compute_rsi(close, 14)
-    macd_line, macd_signal, macd_hist = compute_macd(close)
-    atr = compute_atr(df, 14)
-    vol_sma_20 = (
-        float(df["volume"].rolling(20).mean().iloc[-1])
-        if "volume" in df.columns and len(df) >= 20
-        else volume
-    )
+    values = _indicators(close, high, low, vol, price=float(bars[-1].close))
+    trend = get_trend(values["sma_20"], values["sma_50"], values["rsi_14"])
+
+    return StockIndicators(symbol=symbol, trend=trend, **values)
+
+
+def _summarize_market(snapshot: MarketSnapshot) -> None:
+    """Fill in the market summary (SPY/QQQ/VIX if available) from the scanned stocks."""
+    by_symbol = {s.symbol: s for s in snapshot.stocks}
+    for symbol in config.MARKET_INDICATORS:
+        stock = by_symbol.get(symbol)
+        if stock:
+            snapshot.market_summary[f"{symbol}_price"] = stock.price
+            snapshot.market_summary[f"{symbol}_trend"] = stock.trend
 
-    trend = get_trend(sma_20, sma_50, rsi)
-
-    return StockIndicators(
-        symbol=symbol,
-        price=price,
-        sma_20=sma_20,
-        sma_50=sma_50,
-        rsi_14=rsi,
-        macd_line=macd_line,
-        macd_signal=macd_signal,
-        macd_histogram=macd_hist,
-        volume=volume,
-        volume_sma_20=vol_sma_20,
-        atr_14=atr,
-        trend=trend,
+
+def subset_snapshot(snapshot: MarketSnapshot, symbols: Iterable[str]) -> MarketSnapshot:
+    """
+    Project a snapshot onto a smaller symbol universe (plus the market indicators).
+
+    Stocks keep the order run_scanner would have produced for that universe, and
+    errors for symbols outside it are dropped.
+    """
+    wanted = dict.fromkeys(list(symbols) + config.MARKET_INDICATORS)
+    by_symbol = {s.symbol: s for s in snapshot.stocks}
+    subset = MarketSnapshot(
+        timestamp=snapshot.timestamp,
+        stocks=[by_symbol[s] for s in wanted if s in by_symbol],
     )
+    for e in snapshot.errors:
+        symbol, sep, _ = e.partition(":")
+        if not sep or symbol in wanted:
+            subset.errors.append(e)
+    _summarize_market(subset)
+    return subset
+
+
+def _snapshot_cache_key(symbols: list[str], settings: SmaSettings) -> str:
+    """Identify a scan by its timeframe and symbol universe."""
+    return "|".join([settings.bar_size, settings.duration, ",".join(sorted(symbols))])
+
+
+def _load_cached_snapshot(key: str) -> Optional[MarketSnapshot]:
+    """Return the cached snapshot for key if it is younger than SCAN_INTERVAL_MINUTES."""
+    try:
+        age = time.time() - SNAPSHOT_CACHE_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if age >= config.SCAN_INTERVAL_MINUTES * 60:
+        return None
+
+    try:
+        import pandas as pd
+
+        df = pd.read_parquet(SNAPSHOT_CACHE_FILE)
+    except Exception as e:
+        logger.debug(f"Ignoring unreadable snapshot cache: {e}")
+        return None
+    if df.empty or (df["cache_key"] != key).any():
+        return None
+
+    snapshot = MarketSnapshot(timestamp=df["timestamp"].iloc[0].to_pydatetime())
+    for row in df.drop(columns=["cache_key", "timestamp"]).to_dict("records"):
+        row["volume"] = int(row["volume"])
+        row["error"] = row["error"] if isinstance(row["error"], str) else None
+        snapshot.stocks.append(StockIndicators(**row))
+    _summarize_market(snapshot)
+    return snapshot
+
+
+def _save_cached_snapshot(key: str, snapshot: MarketSnapshot) -> None:
+    """Persist snapshot so reports within the scan interval can skip the IBKR round-trip."""
+    records = [
+        {**asdict(s), "cache_key": key, "timestamp": snapshot.timestamp} for s in snapshot.stocks
+    ]
+    try:
+        import pandas as pd
+
+        pd.DataFrame(records).to_parquet(SNAPSHOT_CACHE_FILE, index=False)
+    except Exception as e:
+        logger.debug(f"Could not write snapshot cache: {e}")
 
 
-def run_scanner(symbols: Optional[Iterable[str]] = None, strategy_type: Optional[str] = None) -> MarketSnapshot:
+def run_scanner(
+    symbols: Optional[Iterable[str]] = None,
+    strategy_type: Optional[str] = None,
+    use_cache: bool = True,
+) -> MarketSnapshot:
     """
     Run market scanner on the given symbols (or default from config).
     Returns a MarketSnapshot with indicators for each stock.
+
+    If use_cache is set, a snapshot of the same symbols and timeframe taken within
+    the last SCAN_INTERVAL_MINUTES is returned instead of re-fetching from IBKR.
     """
     base_symbols = list(symbols) if symbols is not None else list(config.SCAN_SYMBOLS)
     all_symbols = list(dict.fromkeys(base_symbols + config.MARKET_INDICATORS))
+    settings = _get_sma_settings(strategy_type)
+    cache_key = _snapshot_cache_key(all_symbols, settings)
+    if use_cache:
+        cached = _load_cached_snapshot(cache_key)
+        if cached is not None:
+            logger.info("Using cached market snapshot")
+            return cached
+
     snapshot = MarketSnapshot(timestamp=datetime.now())
 
-    if not connect():
-        snapshot.errors.append("Failed to connect to IBKR")
-        return snapshot
+    with session() as connected:
+        if not connected:
+            snapshot.errors.append("Failed to connect to IBKR")
+            return snapshot
 
-    try:
+        # All symbols share one timeframe, so fetch their bars as a single concurrent
+        # batch and then compute indicators in-process.
+        bars_by_symbol = fetch_historical_bars_batch(
+            all_symbols,
+            duration=settings.duration,
+            bar_size=settings.bar_size,
+        )
         for symbol in all_symbols:
             try:
-                indicators = scan_symbol(symbol, strategy_type=strategy_type)
+                indicators = _indicators_from_bars(symbol, bars_by_symbol.get(symbol))
                 if indicators:
                     snapshot.stocks.append(indicators)
                     if indicators.error:
@@ -196,16 +378,10 @@ def run_scanner(symbols: Optional[Iterable[str]] = None, strategy_type: Optional
                 logger.warning(f"Scanner error for {symbol}: {e}")
                 snapshot.errors.append(f"{symbol}: {str(e)}")
 
-        # Market summary (SPY/QQQ/VIX if available)
-        spy = next((s for s in snapshot.stocks if s.symbol == "SPY"), None)
-        qqq = next((s for s in snapshot.stocks if s.symbol == "QQQ"), None)
-        if spy:
-            snapshot.market_summary["SPY_price"] = spy.price
-            snapshot.market_summary["SPY_trend"] = spy.trend
-        if qqq:
-            snapshot.market_summary["QQQ_price"] = qqq.price
-            snapshot.market_summary["QQQ_trend"] = qqq.trend
-    finally:
-        disconnect()
+        _summarize_market(snapshot)
+
+    # Only cache complete scans so a transient fetch failure is retried next time.
+    if not snapshot.errors:
+        _save_cached_snapshot(cache_key, snapshot)
 
     return snapshot
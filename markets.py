@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Iterable, Tuple
 
 
@@ -32,5 +33,11 @@ def infer_market(symbols: Iterable[str]) -> Tuple[str, str]:
 
     Assumes all symbols belong to the same market; falls back to US/Eastern.
     """
+    return _infer_cached(tuple(symbols))
+
+
+@lru_cache(maxsize=32)
+def _infer_cached(symbols: Tuple[str, ...]) -> Tuple[str, str]:
+    # Reports are generated for the same few universes over and over.
     return _infer_from_suffix(symbols)
 
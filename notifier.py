@@ -2,16 +2,55 @@
 Notification module - send reports via Telegram, Email, or WhatsApp.
 """
 
+import hashlib
 import logging
+import os
 from pathlib import Path
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import config
 
 logger = logging.getLogger(__name__)
 
+# Shared HTTP session so repeated sends reuse the same TCP/TLS connection. The
+# Telegram bot polls through it too. Retry covers connection errors and gateway
+# errors on idempotent requests (urllib3 does not retry POSTs on status by default).
+# Read timeouts are never retried: for getUpdates they are just an idle long poll, and
+# read=False makes them surface as requests' ReadTimeout rather than a ConnectionError
+# after several more full-length polls.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=8,  # covers telegram_bot's poll plus its 4 reply senders
+        max_retries=Retry(
+            total=3, read=False, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+        ),
+    ),
+)
+
+# Telegram rejects messages over 4096 characters; leave some headroom.
+TELEGRAM_MAX_LEN = 4000
+
+
+def _split_message(message: str, max_len: int = TELEGRAM_MAX_LEN) -> list[str]:
+    """Split message into chunks of at most max_len characters, preferring line breaks."""
+    chunks: list[str] = []
+    while len(message) > max_len:
+        cut = message.rfind("\n", 0, max_len + 1)
+        if cut <= 0:
+            cut = max_len
+        chunks.append(message[:cut])
+        message = message[cut:].lstrip("\n")
+    if message:
+        chunks.append(message)
+    return chunks
+
 
 def send_telegram(
     message: str, parse_mode: Optional[str] = None, chat_id: Optional[str] = None
@@ -27,14 +66,12 @@ def send_telegram(
 
     url = f"https://api.telegram.org/bot{config.TELEGRAM_BOT_TOKEN}/sendMessage"
     # Telegram has 4096 char limit - split long messages
-    max_len = 4000
-    for i in range(0, len(message), max_len):
-        chunk = message[i : i + max_len]
+    for chunk in _split_message(message):
         payload = {"chat_id": target_chat_id, "text": chunk}
         if parse_mode:
             payload["parse_mode"] = parse_mode
         try:
-            r = requests.post(url, json=payload, timeout=10)
+            r = _SESSION.post(url, json=payload, timeout=10)
             r.raise_for_status()
         except Exception as e:
             logger.error(f"Telegram send failed: {e}")
@@ -122,6 +159,27 @@ def send_whatsapp(message: str) -> bool:
         return False
 
 
+# Digest of the last content written to report_latest.txt by this process.
+_last_report_digest: Optional[bytes] = None
+
+
+def _write_latest_report(path: Path, content: str) -> None:
+    """
+    Atomically replace path with content, skipping the write if it is unchanged.
+    The content is written to a temporary file and renamed into place, so readers
+    (and retries) never see a half-written report.
+    """
+    global _last_report_digest
+    data = content.encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    if digest == _last_report_digest and path.exists():
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    _last_report_digest = digest
+
+
 def send_report(report_content: str, session: str) -> bool:
     """
     Send report via all configured notification methods.
@@ -129,7 +187,7 @@ def send_report(report_content: str, session: str) -> bool:
     """
     subject = f"Algo Trading Bot - {session} Report"
     report_path = config.REPORTS_DIR / f"report_latest.txt"
-    report_path.write_text(report_content, encoding="utf-8")
+    _write_latest_report(report_path, report_content)
 
     success = False
     for method in config.NOTIFICATION_METHODS:
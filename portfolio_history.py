@@ -1,13 +1,20 @@
 import json
+import os
+from collections import deque
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from typing import List
 
 import config
-from ibkr_connection import get_account_summary, get_positions, connect, disconnect
+from ibkr_connection import get_account_summary, get_positions, session
 
 
-HISTORY_FILE = config.DATA_DIR / "portfolio_history.json"
+# Append-only JSON Lines: one snapshot per line.
+HISTORY_FILE = config.DATA_DIR / "portfolio_history.jsonl"
+LEGACY_HISTORY_FILE = config.DATA_DIR / "portfolio_history.json"
+
+# Rewrite the file down to the last N entries once it grows past this many times N.
+COMPACT_FACTOR = 10
 
 
 @dataclass
@@ -16,25 +23,73 @@ class PortfolioSnapshot:
     total_value: float
 
 
-def _load_history() -> List[PortfolioSnapshot]:
-    if not HISTORY_FILE.exists():
-        return []
-    try:
-        raw = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        return []
+def _parse_lines(lines) -> List[PortfolioSnapshot]:
     out: List[PortfolioSnapshot] = []
-    for item in raw:
+    for line in lines:
         try:
-            out.append(PortfolioSnapshot(**item))
-        except TypeError:
+            out.append(PortfolioSnapshot(**json.loads(line)))
+        except (ValueError, TypeError):
             continue
     return out
 
 
-def _save_history(items: List[PortfolioSnapshot]) -> None:
+def _replace_history(text: str) -> None:
+    """Replace the history file with text via a temp file, so a crash never truncates it."""
+    tmp = HISTORY_FILE.with_name(HISTORY_FILE.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, HISTORY_FILE)
+
+
+def _migrate_legacy_history() -> None:
+    """Convert the old single-JSON-array history file to JSON Lines, once."""
+    if HISTORY_FILE.exists() or not LEGACY_HISTORY_FILE.exists():
+        return
+    try:
+        raw = json.loads(LEGACY_HISTORY_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return
+    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    _replace_history("".join(json.dumps(item) + "\n" for item in raw))
+    LEGACY_HISTORY_FILE.unlink()
+
+
+def _load_history(limit: int) -> List[PortfolioSnapshot]:
+    """Load the last `limit` snapshots without parsing the rest of the file."""
+    _migrate_legacy_history()
+    if not HISTORY_FILE.exists():
+        return []
+    try:
+        with HISTORY_FILE.open(encoding="utf-8") as f:
+            tail = deque(f, maxlen=limit)
+    except OSError:
+        return []
+    return _parse_lines(tail)
+
+
+def _append_history(item: PortfolioSnapshot) -> None:
+    _migrate_legacy_history()
     HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    HISTORY_FILE.write_text(json.dumps([asdict(i) for i in items], indent=2), encoding="utf-8")
+    line = json.dumps(asdict(item)) + "\n"
+    with HISTORY_FILE.open("a", encoding="utf-8") as f:
+        f.write(line)
+    _compact_history(len(line.encode("utf-8")))
+
+
+def _compact_history(line_size: int) -> None:
+    """
+    Trim the file to the configured length once it exceeds COMPACT_FACTOR times that.
+
+    Snapshot lines are all about line_size bytes, so the file size says when the
+    threshold may have been passed; only then is the file read and lines counted.
+    """
+    limit = config.PORTFOLIO_HISTORY_LENGTH
+    if HISTORY_FILE.stat().st_size <= line_size * limit * COMPACT_FACTOR:
+        return
+    with HISTORY_FILE.open(encoding="utf-8") as f:
+        lines = f.readlines()
+    if len(lines) <= limit * COMPACT_FACTOR:
+        return
+    _replace_history("".join(lines[-limit:]))
 
 
 def _extract_total_value() -> float | None:
@@ -42,9 +97,9 @@ def _extract_total_value() -> float | None:
     Pull total account value from account summary.
     Tries common keys across base currency values.
     """
-    if not connect():
-        return None
-    try:
+    with session() as connected:
+        if not connected:
+            return None
         rows = get_account_summary()
         # ib_async accountSummary rows have fields: tag, value, currency, account
         # We look for NetLiquidation or TotalCashValue in base currency.
@@ -67,8 +122,6 @@ def _extract_total_value() -> float | None:
         # Prefer NetLiquidation over TotalCashValue
         candidates.sort(key=lambda x: 0 if x[0] == "NetLiquidation" else 1)
         return candidates[0][2]
-    finally:
-        disconnect()
 
 
 def record_snapshot() -> float | None:
@@ -78,11 +131,7 @@ def record_snapshot() -> float | None:
     value = _extract_total_value()
     if value is None:
         return None
-    history = _load_history()
-    history.append(PortfolioSnapshot(timestamp=datetime.now().isoformat(timespec="minutes"), total_value=value))
-    # Trim to configured length
-    history = history[-config.PORTFOLIO_HISTORY_LENGTH :]
-    _save_history(history)
+    _append_history(PortfolioSnapshot(timestamp=datetime.now().isoformat(timespec="minutes"), total_value=value))
     return value
 
 
@@ -90,17 +139,16 @@ def get_recent_history() -> List[PortfolioSnapshot]:
     """
     Get the most recent N snapshots (where N is PORTFOLIO_HISTORY_LENGTH).
     """
-    history = _load_history()
-    return history[-config.PORTFOLIO_HISTORY_LENGTH :]
+    return _load_history(config.PORTFOLIO_HISTORY_LENGTH)
 
 
 def format_positions() -> str:
     """
     Return a human-readable summary of current positions.
     """
-    if not connect():
-        return "Could not connect to IBKR for positions."
-    try:
+    with session() as connected:
+        if not connected:
+            return "Could not connect to IBKR for positions."
         positions = get_positions()
         if not positions:
             return "No open positions."
@@ -116,6 +164,4 @@ def format_positions() -> str:
                 f"{symbol} ({sec_type} {currency}): {position} @ {avg_cost:.2f}"
             )
         return "\n".join(lines)
-    finally:
-        disconnect()
 
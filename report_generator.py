@@ -4,135 +4,153 @@ Creates formatted reports for 8am (pre-market) and 8pm (post-market).
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Iterator
 from zoneinfo import ZoneInfo
 
 import config
+from ibkr_connection import session as ibkr_session
 from market_scanner import run_scanner, MarketSnapshot
-from sma_strategy import run_strategy, StrategyResult, Signal, _get_sma_settings
+from sma_strategy import run_strategy, StrategyResult, Signal, _get_sma_settings, resolve_strategy_type
 from portfolio_history import record_snapshot, get_recent_history, format_positions
 from markets import infer_market
 
 logger = logging.getLogger(__name__)
 
+# Single worker so writes to the same per-minute file land in submission order.
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report-save")
+_last_saved: Optional[tuple[Path, int]] = None
 
-def format_market_report(snapshot: MarketSnapshot, session: str) -> str:
-    """Format market scanner snapshot into a readable report."""
-    lines = [
-        f"📊 MARKET REPORT - {session}",
-        f"Generated: {snapshot.timestamp.strftime('%Y-%m-%d %H:%M')}",
-        "",
-        "=== MARKET INDICATORS ===",
-    ]
+
+_TREND_EMOJI = {"bullish": "🟢", "bearish": "🔴"}
+_SIG_LABEL = {Signal.BUY: "🟢 BUY", Signal.SELL: "🔴 SELL", Signal.HOLD: "⚪ HOLD"}
+_BORDER = "═" * 35
+
+
+def _format_stock_entry(stock) -> str:
+    """Report entry (two lines) for a single scanned stock."""
+    return (
+        f"{_TREND_EMOJI.get(stock.trend, '⚪')} {stock.symbol}: ${stock.price:.2f} | "
+        f"SMA20: ${stock.sma_20:.2f} | SMA50: ${stock.sma_50:.2f} | RSI: {stock.rsi_14:.1f} | "
+        f"Trend: {stock.trend}\n"
+        f"   MACD: {stock.macd_histogram:+.4f} | ATR: ${stock.atr_14:.2f} | Vol: {stock.volume:,}"
+    )
+
+
+def _market_report_lines(snapshot: MarketSnapshot, session: str) -> Iterator[str]:
+    yield f"📊 MARKET REPORT - {session}"
+    yield f"Generated: {snapshot.timestamp.strftime('%Y-%m-%d %H:%M')}"
+    yield ""
+    yield "=== MARKET INDICATORS ==="
 
     for stock in snapshot.stocks:
         # Skip symbols that failed to fetch or have errors; they will still appear in the
         # errors section below so the user understands what was skipped.
         if getattr(stock, "error", None):
             continue
-        emoji = "🟢" if stock.trend == "bullish" else "🔴" if stock.trend == "bearish" else "⚪"
-        lines.append(
-            f"{emoji} {stock.symbol}: ${stock.price:.2f} | SMA20: ${stock.sma_20:.2f} | "
-            f"SMA50: ${stock.sma_50:.2f} | RSI: {stock.rsi_14:.1f} | Trend: {stock.trend}"
-        )
-        lines.append(
-            f"   MACD: {stock.macd_histogram:+.4f} | ATR: ${stock.atr_14:.2f} | Vol: {stock.volume:,}"
-        )
+        yield _format_stock_entry(stock)
 
     if snapshot.market_summary:
-        lines.append("")
-        lines.append("=== MARKET SUMMARY ===")
+        yield ""
+        yield "=== MARKET SUMMARY ==="
         for k, v in snapshot.market_summary.items():
-            lines.append(f"  {k}: {v}")
+            yield f"  {k}: {v}"
 
     if snapshot.errors:
-        lines.append("")
-        lines.append("⚠️ Errors:")
+        yield ""
+        yield "⚠️ Errors:"
         for e in snapshot.errors:
-            lines.append(f"  - {e}")
+            yield f"  - {e}"
 
-    return "\n".join(lines)
 
+def format_market_report(snapshot: MarketSnapshot, session: str) -> str:
+    """Format market scanner snapshot into a readable report."""
+    return "\n".join(_market_report_lines(snapshot, session))
 
-def format_strategy_report(results: list[StrategyResult]) -> str:
-    """Format SMA strategy results into a report."""
+
+def _strategy_report_lines(results: list[StrategyResult]) -> Iterator[str]:
     if not results:
-        return "No strategy results."
+        yield "No strategy results."
+        return
 
-    lines = [
-        "=== SMA CROSSOVER STRATEGY ===",
-    ]
+    yield "=== SMA CROSSOVER STRATEGY ==="
     for r in results:
-        sig_emoji = "🟢 BUY" if r.signal == Signal.BUY else "🔴 SELL" if r.signal == Signal.SELL else "⚪ HOLD"
-        lines.append(
-            f"{r.symbol}: {sig_emoji} | Price: ${r.price:.2f} | "
+        yield (
+            f"{r.symbol}: {_SIG_LABEL[r.signal]} | Price: ${r.price:.2f} | "
             f"SMA_fast: ${r.fast_sma:.2f} | SMA_slow: ${r.slow_sma:.2f} | Pos: {r.current_position}"
         )
-        lines.append(f"   {r.message}")
-    return "\n".join(lines)
+        yield f"   {r.message}"
 
 
-def build_strategy_section(
-    strategy_symbols: Optional[Iterable[str]] = None,
-    strategy_type: Optional[str] = None,
-) -> str:
-    """Build the SMA strategy section, handling errors gracefully."""
-    lines: list[str] = []
+def format_strategy_report(results: list[StrategyResult]) -> str:
+    """Format SMA strategy results into a report."""
+    return "\n".join(_strategy_report_lines(results))
+
+
+def _strategy_section_lines(
+    strategy_symbols: Optional[Iterable[str]], strategy_type: Optional[str]
+) -> Iterator[str]:
+    # Each part's data is gathered before its lines are yielded, so a failure only
+    # replaces that part's body with a placeholder.
 
     # 1) Record and show portfolio history
+    yield "=== PORTFOLIO VALUE HISTORY ==="
     try:
         latest_value = record_snapshot()
         history = get_recent_history()
-        lines.append("=== PORTFOLIO VALUE HISTORY ===")
+    except Exception as e:
+        logger.warning(f"Portfolio history section failed: {e}")
+        yield "(Failed to load portfolio history)"
+    else:
         if latest_value is None and not history:
-            lines.append("Could not retrieve portfolio value.")
+            yield "Could not retrieve portfolio value."
         else:
             for snap in history:
-                lines.append(f"{snap.timestamp}: ${snap.total_value:,.2f}")
-        lines.append("")
-    except Exception as e:
-        logger.warning(f"Portfolio history section failed: {e}")
-        lines.append("=== PORTFOLIO VALUE HISTORY ===")
-        lines.append("(Failed to load portfolio history)")
-        lines.append("")
+                yield f"{snap.timestamp}: ${snap.total_value:,.2f}"
+    yield ""
 
     # 2) Current positions
+    yield "=== CURRENT POSITIONS ==="
     try:
-        lines.append("=== CURRENT POSITIONS ===")
-        lines.append(format_positions())
-        lines.append("")
+        positions = format_positions()
     except Exception as e:
         logger.warning(f"Positions section failed: {e}")
-        lines.append("=== CURRENT POSITIONS ===")
-        lines.append("(Failed to load positions)")
-        lines.append("")
+        positions = "(Failed to load positions)"
+    yield positions
+    yield ""
 
     # 3) SMA strategy settings + results
     try:
         settings = _get_sma_settings(strategy_type)
-        bar = settings["bar_size"]
-        fast = settings["fast"]
-        slow = settings["slow"]
-        mode = (strategy_type or config.SMA_STRATEGY_TYPE or "position").lower()
-        lines.append("=== SMA STRATEGY SETTINGS ===")
-        lines.append(f"Mode: {mode}")
-        lines.append(f"Timeframe: {bar}")
-        lines.append(f"SMA fast/slow: {fast}/{slow}")
-        lines.append("")
+        mode = resolve_strategy_type(strategy_type)
     except Exception as e:
         logger.warning(f"Strategy settings section failed: {e}")
+    else:
+        yield "=== SMA STRATEGY SETTINGS ==="
+        yield f"Mode: {mode}"
+        yield f"Timeframe: {settings.bar_size}"
+        yield f"SMA fast/slow: {settings.fast}/{settings.slow}"
+        yield ""
 
     try:
         results = run_strategy(strategy_symbols, strategy_type=strategy_type)
-        lines.append(format_strategy_report(results))
     except Exception as e:
         logger.warning(f"Strategy report failed: {e}")
-        lines.append("=== SMA CROSSOVER STRATEGY ===")
-        lines.append("(Strategy evaluation skipped due to connection/error)")
+        yield "=== SMA CROSSOVER STRATEGY ==="
+        yield "(Strategy evaluation skipped due to connection/error)"
+    else:
+        yield from _strategy_report_lines(results)
 
-    return "\n".join(lines)
+
+def build_strategy_section(
+    strategy_symbols: Optional[Iterable[str]] = None,
+    strategy_type: Optional[str] = None,
+) -> str:
+    """Build the SMA strategy section, handling errors gracefully."""
+    return "\n".join(_strategy_section_lines(strategy_symbols, strategy_type))
 
 
 def generate_report(
@@ -141,12 +159,16 @@ def generate_report(
     include_strategy: bool = True,
     strategy_symbols: Optional[Iterable[str]] = None,
     strategy_type: Optional[str] = None,
+    snapshot: Optional[MarketSnapshot] = None,
+    use_cache: bool = True,
 ) -> str:
     """
     Generate full report: market scan + (optionally) strategy evaluation.
 
     session: logical session label, e.g. "pre-market" / "post-market".
     The displayed title is adjusted based on the inferred market & timezone.
+    snapshot: an already-scanned snapshot of `symbols` to report instead of scanning.
+    use_cache: passed to run_scanner when this report scans for itself.
     """
     # Infer market + timezone from the symbols universe
     symbol_universe = list(symbols) if symbols is not None else list(config.SCAN_SYMBOLS)
@@ -162,30 +184,50 @@ def generate_report(
     title = f"{market_name} {phase_label} REPORT"
 
     lines = [
-        f"═══════════════════════════════════",
+        _BORDER,
         f"  ALGO TRADING BOT - {title}",
         f"  {now_market.strftime('%Y-%m-%d %H:%M')} ({tz_name})",
-        f"═══════════════════════════════════",
+        _BORDER,
         "",
     ]
 
-    # Market scan
-    snapshot = run_scanner(symbols=symbols, strategy_type=strategy_type)
-    lines.append(format_market_report(snapshot, session))
-    lines.append("")
-    lines.append("")
+    # The strategy section also talks to IBKR; share one connection with the scan.
+    with ibkr_session() if include_strategy else nullcontext():
+        # Market scan
+        if snapshot is None:
+            snapshot = run_scanner(symbols=symbols, strategy_type=strategy_type, use_cache=use_cache)
+        lines.append(format_market_report(snapshot, session))
+        lines.append("")
+        lines.append("")
 
-    # SMA strategy (optional - run during trading hours only for post-market, or both)
-    if include_strategy:
-        lines.append(build_strategy_section(strategy_symbols, strategy_type=strategy_type))
+        # SMA strategy (optional - run during trading hours only for post-market, or both)
+        if include_strategy:
+            lines.append(build_strategy_section(strategy_symbols, strategy_type=strategy_type))
 
     return "\n".join(lines)
 
 
+def _write_report(path: Path, content: str) -> None:
+    try:
+        path.write_text(content, encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"Failed to save report to {path}: {e}")
+        return
+    logger.info(f"Report saved to {path}")
+
+
 def save_report(content: str) -> Path:
-    """Save report to file and return path."""
+    """
+    Save report to file and return path.
+
+    The write happens on a background thread; an identical report already saved to
+    the same path (reports are named per minute) is not written again.
+    """
+    global _last_saved
     fname = f"report_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
     path = config.REPORTS_DIR / fname
-    path.write_text(content, encoding="utf-8")
-    logger.info(f"Report saved to {path}")
+    key = (path, hash(content))
+    if key != _last_saved:
+        _last_saved = key
+        _SAVE_EXECUTOR.submit(_write_report, path, content)
     return path
@@ -4,20 +4,41 @@ Uses APScheduler with a persistent job store.
 """
 
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 import config
+from ibkr_connection import heartbeat, qualify_contracts
+from market_scanner import run_scanner, subset_snapshot
 from report_generator import generate_report, save_report
 from notifier import send_report, send_telegram_report_to_user
-from telegram_users import all_users, get_user
+from telegram_users import TelegramUser, all_users, get_user, users_version
 
 logger = logging.getLogger(__name__)
 
 _scheduler: BlockingScheduler | None = None
 
+# How often to check the persistent IBKR connection between reports.
+IBKR_HEARTBEAT_MINUTES = 5
+
+# Subscribed users plus an index of who fires when, rebuilt whenever the users file
+# changes: minute of day -> positions in _SUBSCRIBED_USERS, and the users with a frequency.
+_SUBSCRIBED_USERS: list[TelegramUser] = []
+_USER_TIME_INDEX: dict[int, list[int]] = {}
+_FREQ_USERS: list[int] = []
+_users_version: int | None = None
+
+# Last minute the user dispatcher handled, and how far back it catches up after a delay.
+_last_dispatch: datetime | None = None
+MAX_CATCH_UP_MINUTES = 30
+
+# Jobs share one worker (see start_scheduler), so a job due while another is running
+# starts late; allow that instead of dropping it as missed after APScheduler's 1s default.
+JOB_MISFIRE_GRACE_SECONDS = 30 * 60
+
 
 def _run_scheduled_report():
     """Generate report and send via configured channels."""
@@ -52,6 +73,7 @@ def _run_scheduled_report():
             include_strategy=True,
             strategy_symbols=strategy_symbols,
             strategy_type=strategy_type,
+            use_cache=False,
         )
         save_report(report)
         send_report(report, session)
@@ -59,42 +81,91 @@ def _run_scheduled_report():
         logger.exception(f"Report generation failed: {e}")
 
 
+def _refresh_user_index() -> None:
+    """Rebuild the per-minute user index if the users file changed since the last tick."""
+    global _SUBSCRIBED_USERS, _USER_TIME_INDEX, _FREQ_USERS, _users_version
+    version = users_version()
+    if version == _users_version:
+        return
+
+    subscribed = [u for u in all_users() if u.subscribed]
+    time_index: dict[int, list[int]] = {}
+    freq_users = []
+    for i, user in enumerate(subscribed):
+        # 1) Frequency-based trigger if configured
+        if (user.frequency_minutes or 0) > 0:
+            freq_users.append(i)
+        # 2) Fallback / additional: explicit times
+        for minute in user.effective_minutes():
+            time_index.setdefault(minute, []).append(i)
+
+    _SUBSCRIBED_USERS, _USER_TIME_INDEX, _FREQ_USERS = subscribed, time_index, freq_users
+    _users_version = version
+
+
 def _run_user_reports():
     """Generate and send reports for subscribed Telegram users based on their times."""
-    now = datetime.now()
-    current_time = now.strftime("%H:%M")
-    minute_of_day = now.hour * 60 + now.minute
-    hour = now.hour
-    session = "pre-market" if hour < 12 else "post-market"
-
-    users = all_users()
-    if not users:
+    global _last_dispatch
+    now = datetime.now().replace(second=0, microsecond=0)
+    # A coalesced misfire can re-run the job in a minute already dispatched. A jump back
+    # by more than the catch-up window (e.g. the end of DST) is treated as a fresh start.
+    if _last_dispatch is not None and now <= _last_dispatch < now + timedelta(minutes=MAX_CATCH_UP_MINUTES):
         return
 
-    for user in users:
-        if not user.subscribed:
-            continue
+    # A run can start late when other jobs hold the single worker (and missed runs are
+    # coalesced), so cover every minute since the last dispatch, not just this one.
+    ticks = [now]
+    if _last_dispatch is not None and _last_dispatch < now:
+        first = max(_last_dispatch + timedelta(minutes=1), now - timedelta(minutes=MAX_CATCH_UP_MINUTES))
+        ticks = [first + timedelta(minutes=k) for k in range(int((now - first).total_seconds() // 60) + 1)]
+    _last_dispatch = now
 
-        should_run = False
-        # 1) Frequency-based trigger if configured
-        if getattr(user, "frequency_minutes", None):
-            freq = user.frequency_minutes or 0
-            if freq > 0 and minute_of_day % freq == 0:
-                should_run = True
+    _refresh_user_index()
+    due = set()
+    for tick in ticks:
+        minute_of_day = tick.hour * 60 + tick.minute
+        due.update(_USER_TIME_INDEX.get(minute_of_day, ()))
+        due.update(
+            i for i in _FREQ_USERS if minute_of_day % _SUBSCRIBED_USERS[i].frequency_minutes == 0
+        )
+    # Most minutes nobody is due; return before any scanning or report setup.
+    if not due:
+        return
 
-        # 2) Fallback / additional: explicit times
-        if current_time in user.effective_times():
-            should_run = True
+    firing = [_SUBSCRIBED_USERS[i] for i in sorted(due)]
+    hour = now.hour
+    session = "pre-market" if hour < 12 else "post-market"
 
-        if not should_run:
-            continue
+    # Scan once per timeframe over the union of the firing users' symbols; each
+    # user's report is then projected from the shared snapshot.
+    # Scheduled reports always scan fresh: users may fire every 5 minutes (and scalping
+    # uses 5-minute bars), well inside the snapshot cache's SCAN_INTERVAL_MINUTES.
+    snapshots = {}
+    for strategy_type in {u.effective_strategy_type() for u in firing}:
+        universe = dict.fromkeys(
+            s
+            for u in firing
+            if u.effective_strategy_type() == strategy_type
+            for s in u.effective_symbols()
+        )
         try:
-            logger.info(f"Running {session} report for chat_id={user.chat_id} at {current_time}")
+            snapshots[strategy_type] = run_scanner(
+                symbols=list(universe), strategy_type=strategy_type, use_cache=False
+            )
+        except Exception as e:
+            # Fall back to a scan per user below.
+            logger.exception(f"Shared {strategy_type} scan failed: {e}")
+
+    for user in firing:
+        try:
+            logger.info(f"Running {session} report for chat_id={user.chat_id} at {now:%H:%M}")
 
             is_owner = (
                 bool(config.OWNER_TELEGRAM_CHAT_ID)
                 and str(user.chat_id) == config.OWNER_TELEGRAM_CHAT_ID
             )
+            shared = snapshots.get(user.effective_strategy_type())
+            snapshot = subset_snapshot(shared, user.effective_symbols()) if shared else None
 
             if is_owner:
                 # Owner gets both scanner and strategy based on their selected symbols.
@@ -104,6 +175,8 @@ def _run_user_reports():
                     include_strategy=True,
                     strategy_symbols=user.effective_strategy_symbols(),
                     strategy_type=user.effective_strategy_type(),
+                    snapshot=snapshot,
+                    use_cache=False,
                 )
             else:
                 # Other users get only the scanner section; no strategy details or trades.
@@ -112,6 +185,8 @@ def _run_user_reports():
                     symbols=user.effective_symbols(),
                     include_strategy=False,
                     strategy_type=user.effective_strategy_type(),
+                    snapshot=snapshot,
+                    use_cache=False,
                 )
             save_report(report)
             send_telegram_report_to_user(report, session, chat_id=str(user.chat_id))
@@ -119,6 +194,12 @@ def _run_user_reports():
             logger.exception(f"User report failed for chat_id={user.chat_id}: {e}")
 
 
+def _warm_up_ibkr():
+    """Open the persistent IBKR connection and qualify all configured contracts."""
+    symbols = config.SCAN_SYMBOLS + config.TRADE_SYMBOLS + config.MARKET_INDICATORS
+    logger.info(f"Qualified {qualify_contracts(symbols)} contracts")
+
+
 def _parse_time(time_str: str) -> tuple[int, int]:
     """Parse 'HH:MM' to (hour, minute)."""
     parts = time_str.split(":")
@@ -128,7 +209,33 @@ def _parse_time(time_str: str) -> tuple[int, int]:
 def start_scheduler():
     """Start the scheduler for reports."""
     global _scheduler
-    _scheduler = BlockingScheduler()
+    # One worker thread: the persistent IBKR connection is bound to the event loop of
+    # the thread that opened it, so every job that touches IBKR must run there.
+    # Runs delayed behind other jobs still happen, and a backlog of one job collapses into
+    # a single run.
+    _scheduler = BlockingScheduler(
+        executors={"default": ThreadPoolExecutor(max_workers=1)},
+        job_defaults={"misfire_grace_time": JOB_MISFIRE_GRACE_SECONDS, "coalesce": True},
+    )
+
+    # Connect and resolve contracts up front so it is not on the critical path of the
+    # first report.
+    _scheduler.add_job(
+        _warm_up_ibkr,
+        trigger="date",
+        run_date=datetime.now(),
+        id="ibkr_warm_up",
+        name="Connect to IBKR and qualify contracts",
+    )
+
+    # Heartbeat: probe TWS between reports and reconnect if it dropped the session. Runs
+    # at half past the minute so it does not land on the same instant as report jobs.
+    _scheduler.add_job(
+        heartbeat,
+        trigger=CronTrigger(minute=f"*/{IBKR_HEARTBEAT_MINUTES}", second=30),
+        id="ibkr_heartbeat",
+        name="IBKR connection heartbeat",
+    )
 
     # Legacy global schedule based on REPORT_TIMES (uses default config recipients)
     for time_str in config.REPORT_TIMES:
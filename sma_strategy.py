@@ -6,16 +6,15 @@ Buy when fast SMA crosses above slow SMA; sell when fast crosses below slow.
 import logging
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, Iterable
+from typing import NamedTuple, Optional, Iterable
 
-import pandas as pd
+import numpy as np
 
 import config
 from ibkr_connection import (
-    connect,
-    disconnect,
+    session,
     fetch_historical_bars,
-    bars_to_dataframe,
+    fetch_historical_bars_batch,
     place_market_order,
     get_positions,
 )
@@ -29,7 +28,7 @@ class Signal(Enum):
     HOLD = "HOLD"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class StrategyResult:
     symbol: str
     signal: Signal
@@ -40,15 +39,49 @@ class StrategyResult:
     message: str
 
 
-def compute_sma(df: pd.DataFrame, fast: int, slow: int) -> pd.DataFrame:
-    """Add fast and slow SMA columns to DataFrame."""
-    df = df.copy()
-    df["sma_fast"] = df["close"].rolling(window=fast).mean()
-    df["sma_slow"] = df["close"].rolling(window=slow).mean()
-    return df
+def _sma_tail(close: np.ndarray, n: int, k: int = 3) -> np.ndarray:
+    """
+    Return the last k values of the n-period SMA of close, using a cumulative sum
+    over only the last n + k - 1 bars. Values without a full window are NaN.
+    """
+    window = close[-(n + k - 1):]
+    csum = np.concatenate(([0.0], np.cumsum(window, dtype=np.float64)))
+    sma = (csum[n:] - csum[:-n]) / n
+    if len(sma) < k:
+        sma = np.concatenate((np.full(k - len(sma), np.nan), sma))
+    return sma
+
+
+def compute_sma(close: np.ndarray, fast: int, slow: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the last three fast and slow SMA values (enough to detect a crossover
+    and report the latest SMAs) without building full rolling series.
+    """
+    return _sma_tail(close, fast), _sma_tail(close, slow)
+
+
+class SmaSettings(NamedTuple):
+    duration: str
+    bar_size: str
+    fast: int
+    slow: int
+
+
+# Settings per strategy type; shared immutable instances, so nothing is rebuilt per call.
+_SMA_SETTINGS = {
+    "scalping": SmaSettings(duration="2 D", bar_size="5 mins", fast=20, slow=50),
+    "swing": SmaSettings(duration="30 D", bar_size="1 hour", fast=20, slow=50),
+    "position": SmaSettings(duration="12 M", bar_size="1 day", fast=50, slow=200),
+}
+
+
+def resolve_strategy_type(strategy_type: Optional[str] = None) -> str:
+    """Normalize a strategy type, falling back to the configured default and then to 'position'."""
+    mode = (strategy_type or getattr(config, "SMA_STRATEGY_TYPE", "position") or "position").lower()
+    return mode if mode in _SMA_SETTINGS else "position"
 
 
-def _get_sma_settings(strategy_type: Optional[str] = None) -> dict:
+def _get_sma_settings(strategy_type: Optional[str] = None) -> SmaSettings:
     """
     Return settings for the current SMA strategy type.
 
@@ -57,104 +90,86 @@ def _get_sma_settings(strategy_type: Optional[str] = None) -> dict:
       - swing:   1h bars, 20/50 SMA
       - position (default): 1D bars, 50/200 SMA
     """
-    mode = (strategy_type or getattr(config, "SMA_STRATEGY_TYPE", "position")).lower()
-    if mode == "scalping":
-        return {
-            "duration": "2 D",
-            "bar_size": "5 mins",
-            "fast": 20,
-            "slow": 50,
-        }
-    if mode == "swing":
-        return {
-            "duration": "30 D",
-            "bar_size": "1 hour",
-            "fast": 20,
-            "slow": 50,
-        }
-    # position (default)
-    return {
-        "duration": "12 M",
-        "bar_size": "1 day",
-        "fast": 50,
-        "slow": 200,
-    }
-
-
-def detect_crossover(df: pd.DataFrame) -> Signal:
+    return _SMA_SETTINGS[resolve_strategy_type(strategy_type)]
+
+
+def detect_crossover(fast: np.ndarray, slow: np.ndarray) -> Signal:
     """
-    Detect SMA crossover on the latest bars.
+    Detect SMA crossover on the latest bars, given SMA values ending at the latest bar.
     Returns BUY if fast crossed above slow, SELL if fast crossed below slow.
     """
-    if len(df) < 3:
+    if len(fast) < 3 or len(slow) < 3:
         return Signal.HOLD
 
-    # Compare last 3 rows to detect crossover
-    prev = df.iloc[-3]
-    curr = df.iloc[-2]
-    latest = df.iloc[-1]
-
-    prev_fast = prev["sma_fast"]
-    prev_slow = prev["sma_slow"]
-    curr_fast = curr["sma_fast"]
-    curr_slow = curr["sma_slow"]
-    latest_fast = latest["sma_fast"]
-    latest_slow = latest["sma_slow"]
-
-    # Skip if any NaN
-    if pd.isna(prev_fast) or pd.isna(prev_slow) or pd.isna(curr_fast) or pd.isna(curr_slow):
-        return Signal.HOLD
+    # Compare the two bars before the latest to detect crossover, via the sign of
+    # fast - slow. Any NaN makes both comparisons below false, so it yields HOLD.
+    prev_diff, curr_diff = (fast[-3:-1] - slow[-3:-1]).tolist()
 
     # Golden cross: fast was below slow, now above
-    if prev_fast <= prev_slow and curr_fast > curr_slow:
+    if prev_diff <= 0 < curr_diff:
         return Signal.BUY
 
     # Death cross: fast was above slow, now below
-    if prev_fast >= prev_slow and curr_fast < curr_slow:
+    if prev_diff >= 0 > curr_diff:
         return Signal.SELL
 
     return Signal.HOLD
 
 
-def evaluate_symbol(symbol: str, strategy_type: Optional[str] = None) -> Optional[StrategyResult]:
+def _positions_by_symbol(positions) -> dict[str, float]:
+    """Map symbol -> position size, keeping the first entry per symbol."""
+    positions_map: dict[str, float] = {}
+    for pos in positions:
+        symbol = getattr(pos.contract, "symbol", None)
+        if symbol is not None:
+            positions_map.setdefault(symbol, pos.position)
+    return positions_map
+
+
+def evaluate_symbol(
+    symbol: str,
+    strategy_type: Optional[str] = None,
+    bars=None,
+    positions_map: Optional[dict[str, float]] = None,
+) -> Optional[StrategyResult]:
     """
     Evaluate SMA crossover for a single symbol using the configured strategy type.
-    Fetches data, computes SMAs, and returns signal.
+    Fetches data (unless prefetched bars are given), computes SMAs, and returns signal.
+    Pass positions_map (see _positions_by_symbol) to avoid a positions request per symbol.
     """
     settings = _get_sma_settings(strategy_type)
 
-    bars = fetch_historical_bars(
-        symbol,
-        duration=settings["duration"],
-        bar_size=settings["bar_size"],
-    )
+    if bars is None:
+        bars = fetch_historical_bars(
+            symbol,
+            duration=settings.duration,
+            bar_size=settings.bar_size,
+        )
     if not bars:
         return None
 
-    df = bars_to_dataframe(bars)
-    if df is None or len(df) < settings["slow"]:
+    if len(bars) < settings.slow:
         return None
 
-    df = compute_sma(df, settings["fast"], settings["slow"])
-    signal = detect_crossover(df)
+    # Only closes are needed, so read them straight off the bars rather than building
+    # a DataFrame. Kept in float64 since signals depend on small SMA differences.
+    close = np.fromiter((b.close for b in bars), dtype=np.float64, count=len(bars))
+    fast, slow = compute_sma(close, settings.fast, settings.slow)
+    signal = detect_crossover(fast, slow)
 
-    latest = df.iloc[-1]
-    price = float(latest["close"])
-    fast_sma = float(latest["sma_fast"])
-    slow_sma = float(latest["sma_slow"])
+    price = float(close[-1])
+    fast_sma = float(fast[-1])
+    slow_sma = float(slow[-1])
 
     # Get current position
-    positions = get_positions()
-    current_position = 0
-    for pos in positions:
-        if hasattr(pos.contract, "symbol") and pos.contract.symbol == symbol:
-            current_position = pos.position
-            break
+    if positions_map is None:
+        positions_map = _positions_by_symbol(get_positions())
+    current_position = positions_map.get(symbol, 0)
 
     if signal == Signal.BUY:
-        message = f"Golden cross: SMA{settings['fast']} crossed above SMA{settings['slow']}"
+        message = f"Golden cross: SMA{settings.fast} crossed above SMA{settings.slow}"
     elif signal == Signal.SELL:
-        message = f"Death cross: SMA{settings['fast']} crossed below SMA{settings['slow']}"
+        message = f"Death cross: SMA{settings.fast} crossed below SMA{settings.slow}"
     else:
         message = "No crossover signal"
 
@@ -173,17 +188,37 @@ def run_strategy(symbols: Optional[Iterable[str]] = None, strategy_type: Optiona
     """
     Run SMA crossover strategy on all configured symbols.
     Executes trades based on signals.
-    """
-    if not connect():
-        logger.error("Cannot connect to IBKR. Aborting strategy.")
-        return []
 
-    trade_symbols = list(symbols) if symbols is not None else list(config.TRADE_SYMBOLS)
-
-    results = []
-    try:
+    Before any orders, IBKR is queried once for the bars of all symbols (a concurrent
+    batch) and once for positions.
+    """
+    with session() as connected:
+        if not connected:
+            logger.error("Cannot connect to IBKR. Aborting strategy.")
+            return []
+
+        trade_symbols = list(symbols) if symbols is not None else list(config.TRADE_SYMBOLS)
+
+        # Fetch every symbol's bars concurrently up front; ib_async is bound to one
+        # event loop, so this is done with async requests rather than worker threads.
+        # Orders are then placed sequentially below.
+        settings = _get_sma_settings(strategy_type)
+        bars_by_symbol = fetch_historical_bars_batch(
+            trade_symbols,
+            duration=settings.duration,
+            bar_size=settings.bar_size,
+        )
+        # One positions request for the whole run instead of one per symbol.
+        positions_map = _positions_by_symbol(get_positions())
+
+        results = []
         for symbol in trade_symbols:
-            result = evaluate_symbol(symbol, strategy_type=strategy_type)
+            result = evaluate_symbol(
+                symbol,
+                strategy_type=strategy_type,
+                bars=bars_by_symbol.get(symbol) or [],
+                positions_map=positions_map,
+            )
             if result:
                 results.append(result)
 
@@ -191,7 +226,5 @@ def run_strategy(symbols: Optional[Iterable[str]] = None, strategy_type: Optiona
                     place_market_order(symbol, "BUY", config.SHARES_PER_TRADE)
                 elif result.signal == Signal.SELL and result.current_position > 0:
                     place_market_order(symbol, "SELL", result.current_position)
-    finally:
-        disconnect()
 
     return results
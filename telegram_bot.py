@@ -15,15 +15,28 @@ Run with:
   python telegram_bot.py
 """
 
+import json
 import logging
+import random
+import re
+import threading
 import time
-from typing import Optional, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, List
 
 import requests
 
 import config
-from notifier import send_telegram
-from telegram_users import TelegramUser, get_user, upsert_user
+from notifier import _SESSION, send_telegram
+from telegram_users import (
+    TelegramUser,
+    _is_valid_hhmm,
+    get_user,
+    set_subscribed,
+    upsert_user,
+    users_batch,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -31,22 +44,103 @@ logger = logging.getLogger(__name__)
 
 API_URL = f"https://api.telegram.org/bot{config.TELEGRAM_BOT_TOKEN}"
 
+# getUpdates long-poll duration in seconds (Telegram holds the request up to ~50s).
+LONG_POLL_TIMEOUT = 50
+# Maximum updates per getUpdates response (Telegram's upper bound).
+GET_UPDATES_LIMIT = 100
 
-def _call(method: str, **params) -> dict:
+# Retry delay after a failed poll doubles from the initial value up to the max (seconds).
+BACKOFF_INITIAL_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+CONNECT_TIMEOUT = 10
+
+_SPLIT_RE = re.compile(r"[,\s]+")
+
+# Updates are handled on worker threads so a slow reply to one chat does not hold up
+# the others or the next poll. Each chat's updates are queued and handled in order by
+# at most one worker at a time; a chat has a queue only while a worker is draining it.
+_EXEC = ThreadPoolExecutor(max_workers=8, thread_name_prefix="telegram-handler")
+_CHAT_QUEUES: dict[int, deque] = {}
+_CHAT_QUEUES_LOCK = threading.Lock()
+
+# Replies are sent in the background so handlers return without waiting on the HTTP
+# round trip. As with updates, each chat's replies are queued and sent in order by at
+# most one send worker at a time, so a chat with many replies never ties up the others.
+_SEND_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="telegram-send")
+_SEND_QUEUES: dict[str, deque] = {}
+_SEND_QUEUES_LOCK = threading.Lock()
+
+# Replies produced while handling a pass of updates, held until its write commits.
+_reply_buffer = threading.local()
+_SAVE_FAILED_MSG = "Sorry, your settings could not be saved. Please try again."
+
+
+def _call(method: str, *, read_timeout: float = 30, **params) -> dict:
     url = f"{API_URL}/{method}"
-    r = requests.get(url, params=params, timeout=25)
+    r = _SESSION.get(url, params=params, timeout=(CONNECT_TIMEOUT, read_timeout))
     r.raise_for_status()
     return r.json()
 
 
 def _parse_list_arg(text: str) -> List[str]:
-    # Split on commas or whitespace, strip, and uppercase for symbols
-    items: List[str] = []
-    for part in text.replace(",", " ").split():
-        cleaned = part.strip()
-        if cleaned:
-            items.append(cleaned.upper())
-    return items
+    # Split on commas or whitespace and uppercase for symbols
+    return [part.upper() for part in _SPLIT_RE.split(text) if part]
+
+
+def _send_async(text: str, chat_id: str) -> None:
+    """
+    Queue a reply to chat_id behind any earlier replies to the same chat. Inside
+    _handle_updates the reply is held until the pass's users write has committed.
+    """
+    replies = getattr(_reply_buffer, "replies", None)
+    if replies is not None:
+        replies.append((text, chat_id))
+        return
+    with _SEND_QUEUES_LOCK:
+        queue = _SEND_QUEUES.get(chat_id)
+        if queue is not None:
+            queue.append(text)
+            return
+        _SEND_QUEUES[chat_id] = deque([text])
+    _SEND_EXEC.submit(_drain_sends, chat_id)
+
+
+def _drain_sends(chat_id: str) -> None:
+    queue = None
+    try:
+        while True:
+            with _SEND_QUEUES_LOCK:
+                queue = _SEND_QUEUES[chat_id]
+                if not queue:
+                    del _SEND_QUEUES[chat_id]
+                    return
+                text = queue.popleft()
+            send_telegram(text, chat_id=chat_id)
+    except Exception as e:
+        logger.error(f"Telegram reply worker for chat {chat_id} failed: {e}")
+    finally:
+        with _SEND_QUEUES_LOCK:
+            if queue is not None and _SEND_QUEUES.get(chat_id) is queue:
+                del _SEND_QUEUES[chat_id]
+
+
+_WELCOME_MSG = "\n".join([
+    "Welcome to Trading Tabby ≽^•⩊•^≼",
+    "",
+    "You can subscribe to scheduled reports and customise:",
+    "- Stocks in your report",
+    "- Times of day to receive updates",
+    "- Frequency (every N minutes)",
+    "",
+    "Commands:",
+    "/subscribe          - start receiving reports",
+    "/unsubscribe        - stop all reports",
+    "/setsymbols AAPL,MSFT,TSLA",
+    "/settimes 08:00,20:00",
+    "/setfrequency 60",
+    "/timeframe scalping|swing|position",
+    "/help               - show this help",
+])
 
 
 def _handle_start(chat_id: int, username: Optional[str]) -> None:
@@ -55,49 +149,28 @@ def _handle_start(chat_id: int, username: Optional[str]) -> None:
         user = TelegramUser(chat_id=chat_id, username=username)
         upsert_user(user)
 
-    msg_lines = [
-        "Welcome to Trading Tabby ≽^•⩊•^≼",
-        "",
-        "You can subscribe to scheduled reports and customise:",
-        "- Stocks in your report",
-        "- Times of day to receive updates",
-        "- Frequency (every N minutes)",
-        "",
-        "Commands:",
-        "/subscribe          - start receiving reports",
-        "/unsubscribe        - stop all reports",
-        "/setsymbols AAPL,MSFT,TSLA",
-        "/settimes 08:00,20:00",
-        "/setfrequency 60",
-        "/timeframe scalping|swing|position",
-        "/help               - show this help",
-    ]
-    send_telegram("\n".join(msg_lines), chat_id=str(chat_id))
+    _send_async(_WELCOME_MSG, chat_id=str(chat_id))
 
 
 def _handle_subscribe(chat_id: int, username: Optional[str]) -> None:
-    user = get_user(chat_id) or TelegramUser(chat_id=chat_id, username=username)
-    user.subscribed = True
-    upsert_user(user)
-    send_telegram("You are now subscribed to scheduled reports.", chat_id=str(chat_id))
+    set_subscribed(chat_id, username, True)
+    _send_async("You are now subscribed to scheduled reports.", chat_id=str(chat_id))
 
 
 def _handle_unsubscribe(chat_id: int, username: Optional[str]) -> None:
-    user = get_user(chat_id) or TelegramUser(chat_id=chat_id, username=username)
-    user.subscribed = False
-    upsert_user(user)
-    send_telegram("You have been unsubscribed from scheduled reports.", chat_id=str(chat_id))
+    set_subscribed(chat_id, username, False)
+    _send_async("You have been unsubscribed from scheduled reports.", chat_id=str(chat_id))
 
 
 def _handle_setsymbols(chat_id: int, username: Optional[str], args: str) -> None:
     symbols = _parse_list_arg(args)
     if not symbols:
-        send_telegram("Please provide at least one symbol, e.g. /setsymbols AAPL,MSFT", chat_id=str(chat_id))
+        _send_async("Please provide at least one symbol, e.g. /setsymbols AAPL,MSFT", chat_id=str(chat_id))
         return
     user = get_user(chat_id) or TelegramUser(chat_id=chat_id, username=username)
     user.symbols = symbols
     upsert_user(user)
-    send_telegram(
+    _send_async(
         "Your report symbols have been updated to: " + ", ".join(symbols),
         chat_id=str(chat_id),
     )
@@ -106,26 +179,19 @@ def _handle_setsymbols(chat_id: int, username: Optional[str], args: str) -> None
 def _handle_settimes(chat_id: int, username: Optional[str], args: str) -> None:
     times = _parse_list_arg(args)
     if not times:
-        send_telegram("Please provide at least one time, e.g. /settimes 08:00,20:00", chat_id=str(chat_id))
+        _send_async("Please provide at least one time, e.g. /settimes 08:00,20:00", chat_id=str(chat_id))
         return
     # Validation: HH:MM with 00<=HH<=23 and 00<=MM<=59
-    cleaned: List[str] = []
-    for t in times:
-        if len(t) != 5 or t[2] != ":" or not t[:2].isdigit() or not t[3:].isdigit():
-            continue
-        h = int(t[:2])
-        m = int(t[3:])
-        if 0 <= h <= 23 and 0 <= m <= 59:
-            cleaned.append(f"{h:02d}:{m:02d}")
+    cleaned = [t for t in times if _is_valid_hhmm(t)]
     if not cleaned:
-        send_telegram("Times must be in HH:MM 24h format, e.g. 08:00,20:00", chat_id=str(chat_id))
+        _send_async("Times must be in HH:MM 24h format, e.g. 08:00,20:00", chat_id=str(chat_id))
         return
     user = get_user(chat_id) or TelegramUser(chat_id=chat_id, username=username)
     user.times = cleaned
     # If the user sets explicit times, clear frequency so times take precedence.
     user.frequency_minutes = None
     upsert_user(user)
-    send_telegram(
+    _send_async(
         "Your report times have been updated to: " + ", ".join(cleaned),
         chat_id=str(chat_id),
     )
@@ -134,25 +200,25 @@ def _handle_settimes(chat_id: int, username: Optional[str], args: str) -> None:
 def _handle_setfrequency(chat_id: int, username: Optional[str], args: str) -> None:
     args = args.strip()
     if not args:
-        send_telegram("Usage: /setfrequency <minutes>, e.g. /setfrequency 60", chat_id=str(chat_id))
+        _send_async("Usage: /setfrequency <minutes>, e.g. /setfrequency 60", chat_id=str(chat_id))
         return
     try:
         minutes = int(args.split()[0])
     except ValueError:
-        send_telegram("Frequency must be a number of minutes, e.g. /setfrequency 60", chat_id=str(chat_id))
+        _send_async("Frequency must be a number of minutes, e.g. /setfrequency 60", chat_id=str(chat_id))
         return
     if minutes <= 0:
-        send_telegram("Frequency must be a positive number of minutes.", chat_id=str(chat_id))
+        _send_async("Frequency must be a positive number of minutes.", chat_id=str(chat_id))
         return
     if minutes < 5:
-        send_telegram("Minimum frequency is 5 minutes to avoid rate limits.", chat_id=str(chat_id))
+        _send_async("Minimum frequency is 5 minutes to avoid rate limits.", chat_id=str(chat_id))
         return
 
     user = get_user(chat_id) or TelegramUser(chat_id=chat_id, username=username)
     user.frequency_minutes = minutes
     # Keep any existing times; scheduler will trigger on either times OR frequency.
     upsert_user(user)
-    send_telegram(
+    _send_async(
         f"Your report frequency has been set to every {minutes} minutes.",
         chat_id=str(chat_id),
     )
@@ -161,7 +227,7 @@ def _handle_setfrequency(chat_id: int, username: Optional[str], args: str) -> No
 def _handle_timeframe(chat_id: int, username: Optional[str], args: str) -> None:
     mode = (args or "").strip().lower()
     if mode not in {"scalping", "swing", "position"}:
-        send_telegram(
+        _send_async(
             "Usage: /timeframe scalping|swing|position",
             chat_id=str(chat_id),
         )
@@ -175,7 +241,7 @@ def _handle_timeframe(chat_id: int, username: Optional[str], args: str) -> None:
         desc = "Swing (1h bars, SMA 20/50)"
     else:
         desc = "Position (1D bars, SMA 50/200)"
-    send_telegram(
+    _send_async(
         f"Your SMA timeframe has been set to: {desc}",
         chat_id=str(chat_id),
     )
@@ -185,40 +251,120 @@ def _handle_help(chat_id: int) -> None:
     _handle_start(chat_id, None)
 
 
-def _process_update(update: dict) -> None:
-    message = update.get("message") or update.get("edited_message")
+# command -> handler(chat_id, username, args)
+_HANDLERS: dict[str, Callable[[int, Optional[str], str], None]] = {
+    "/start": lambda chat_id, username, args: _handle_start(chat_id, username),
+    "/subscribe": lambda chat_id, username, args: _handle_subscribe(chat_id, username),
+    "/unsubscribe": lambda chat_id, username, args: _handle_unsubscribe(chat_id, username),
+    "/setsymbols": _handle_setsymbols,
+    "/settimes": _handle_settimes,
+    "/setfrequency": _handle_setfrequency,
+    "/timeframe": _handle_timeframe,
+    "/help": lambda chat_id, username, args: _handle_help(chat_id),
+}
+
+
+def _command_message(update: dict) -> Optional[dict]:
+    """The update's message if it is a command in a chat, else None."""
+    message = update.get("message")
     if not message:
-        return
-    chat = message.get("chat") or {}
-    chat_id = chat.get("id")
-    if chat_id is None:
-        return
-    text = message.get("text") or ""
-    username = (message.get("from") or {}).get("username")
+        return None
+    text = message.get("text")
+    if not text or text[0] != "/":
+        return None
+    if (message.get("chat") or {}).get("id") is None:
+        return None
+    return message
+
 
-    if not text.startswith("/"):
+def _process_update(update: dict) -> None:
+    message = _command_message(update)
+    if message is None:
         return
+    chat_id = message["chat"]["id"]
+    text = message["text"]
+    username = (message.get("from") or {}).get("username")
 
     parts = text.split(maxsplit=1)
-    cmd = parts[0].lower()
+    # In groups commands may be addressed as /command@BotName.
+    cmd = parts[0].lower().split("@", 1)[0]
     args = parts[1] if len(parts) > 1 else ""
 
-    if cmd == "/start":
-        _handle_start(chat_id, username)
-    elif cmd == "/subscribe":
-        _handle_subscribe(chat_id, username)
-    elif cmd == "/unsubscribe":
-        _handle_unsubscribe(chat_id, username)
-    elif cmd == "/setsymbols":
-        _handle_setsymbols(chat_id, username, args)
-    elif cmd == "/settimes":
-        _handle_settimes(chat_id, username, args)
-    elif cmd == "/setfrequency":
-        _handle_setfrequency(chat_id, username, args)
-    elif cmd == "/timeframe":
-        _handle_timeframe(chat_id, username, args)
-    elif cmd == "/help":
-        _handle_help(chat_id)
+    handler = _HANDLERS.get(cmd)
+    if handler:
+        handler(chat_id, username, args)
+
+
+def _dispatch(updates: list[dict]) -> None:
+    """
+    Queue a batch of updates on their chats, under one lock acquisition, and start a
+    worker for each chat that had none running.
+    """
+    started = []
+    with _CHAT_QUEUES_LOCK:
+        for update in updates:
+            # Non-commands are dropped here, before they take a queue or a worker.
+            message = _command_message(update)
+            if message is None:
+                continue
+            chat_id = message["chat"]["id"]
+            queue = _CHAT_QUEUES.get(chat_id)
+            if queue is None:
+                queue = _CHAT_QUEUES[chat_id] = deque()
+                started.append(chat_id)
+            queue.append(update)
+    for chat_id in started:
+        _EXEC.submit(_drain_chat, chat_id)
+
+
+def _drain_chat(chat_id: int) -> None:
+    queue = None
+    try:
+        while True:
+            with _CHAT_QUEUES_LOCK:
+                queue = _CHAT_QUEUES[chat_id]
+                if not queue:
+                    del _CHAT_QUEUES[chat_id]
+                    return
+                updates = list(queue)
+                queue.clear()
+            _handle_updates(chat_id, updates)
+    except Exception as e:
+        logger.error(f"Telegram worker for chat {chat_id} failed: {e}")
+    finally:
+        # Never leave a queue behind without a worker, or the chat is never served again.
+        with _CHAT_QUEUES_LOCK:
+            if queue is not None and _CHAT_QUEUES.get(chat_id) is queue:
+                del _CHAT_QUEUES[chat_id]
+
+
+def _handle_updates(chat_id: int, updates: list[dict]) -> None:
+    """
+    Handle one pass of a chat's updates. They share one users write, and their replies
+    are sent only once that write has committed.
+    """
+    replies: list[tuple[str, str]] = []
+    _reply_buffer.replies = replies
+    try:
+        with users_batch():
+            for update in updates:
+                try:
+                    _process_update(update)
+                except Exception as e:
+                    logger.error(f"Error handling Telegram update {update.get('update_id')}: {e}")
+    except Exception as e:
+        logger.error(f"Failed to save Telegram users for chat {chat_id}: {e}")
+        replies = [(_SAVE_FAILED_MSG, str(chat_id))]
+    finally:
+        _reply_buffer.replies = None
+    for text, target in replies:
+        _send_async(text, chat_id=target)
+
+
+def _backoff_sleep(backoff: float) -> float:
+    """Sleep for backoff seconds (+/-20% jitter) and return the next, doubled, backoff."""
+    time.sleep(backoff * random.uniform(0.8, 1.2))
+    return min(BACKOFF_MAX_SECONDS, backoff * 2)
 
 
 def run_bot() -> None:
@@ -227,24 +373,41 @@ def run_bot() -> None:
 
     logger.info("Starting Telegram bot long-polling...")
     offset: Optional[int] = None
-    while True:
-        try:
-            params = {"timeout": 20}
-            if offset is not None:
-                params["offset"] = offset
-            data = _call("getUpdates", **params)
-            if not data.get("ok"):
-                logger.warning(f"Telegram getUpdates returned not ok: {data}")
-                time.sleep(5)
+    backoff = BACKOFF_INITIAL_SECONDS
+    try:
+        while True:
+            try:
+                params = {
+                    "timeout": LONG_POLL_TIMEOUT,
+                    "limit": GET_UPDATES_LIMIT,
+                    # Only commands are handled; don't wake the poll for other update types.
+                    "allowed_updates": json.dumps(["message"]),
+                }
+                if offset is not None:
+                    params["offset"] = offset
+                # Read timeout must outlast the long poll, or every idle poll errors out.
+                data = _call("getUpdates", read_timeout=LONG_POLL_TIMEOUT + 10, **params)
+                if not data.get("ok"):
+                    logger.warning(f"Telegram getUpdates returned not ok: {data}")
+                    backoff = _backoff_sleep(backoff)
+                    continue
+                backoff = BACKOFF_INITIAL_SECONDS
+                updates = data.get("result") or []
+                if updates:
+                    offset = updates[-1]["update_id"] + 1
+                    _dispatch(updates)
+            except KeyboardInterrupt:
+                break
+            except requests.exceptions.ReadTimeout:
+                # An idle long poll that outlasted the read timeout; just poll again.
                 continue
-            for update in data.get("result", []):
-                offset = update["update_id"] + 1
-                _process_update(update)
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            logger.error(f"Error in Telegram bot loop: {e}")
-            time.sleep(5)
+            except Exception as e:
+                logger.error(f"Error in Telegram bot loop: {e}")
+                backoff = _backoff_sleep(backoff)
+    finally:
+        # Let in-flight handlers finish, then the replies they queued.
+        _EXEC.shutdown(wait=True)
+        _SEND_EXEC.shutdown(wait=True)
 
 
 if __name__ == "__main__":
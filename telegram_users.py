@@ -1,25 +1,44 @@
 import json
-from dataclasses import dataclass, asdict
+import logging
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterator, List
 
 import config
 
+# Optional: faster JSON for the per-user rows if orjson is installed
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+
+logger = logging.getLogger(__name__)
+
+# One row per user: users(chat_id INTEGER PRIMARY KEY, json TEXT).
+USERS_DB = config.DATA_DIR / "telegram_users.db"
+LEGACY_USERS_FILE = config.DATA_DIR / "telegram_users.json"
+
+# "HH:MM", 24h.
+_HHMM_RE = re.compile(r"(?:[01][0-9]|2[0-3]):[0-5][0-9]")
 
-USERS_FILE = config.DATA_DIR / "telegram_users.json"
 
 def _is_valid_hhmm(t: str) -> bool:
-    if len(t) != 5 or t[2] != ":":
-        return False
-    hh, mm = t[:2], t[3:]
-    if not hh.isdigit() or not mm.isdigit():
-        return False
-    h = int(hh)
-    m = int(mm)
-    return 0 <= h <= 23 and 0 <= m <= 59
+    return _HHMM_RE.fullmatch(t) is not None
 
 
-@dataclass
+@dataclass(slots=True)
 class TelegramUser:
     chat_id: int
     username: str | None = None
@@ -29,63 +48,229 @@ class TelegramUser:
     frequency_minutes: int | None = None  # If set, send every N minutes
     strategy_type: str | None = None  # "scalping", "swing", "position"
 
-    def effective_symbols(self) -> List[str]:
-        from config import SCAN_SYMBOLS
+    def to_dict(self) -> dict:
+        """Storage form; the lists are copied so the stored row can't alias the instance."""
+        return {
+            "chat_id": self.chat_id,
+            "username": self.username,
+            "subscribed": self.subscribed,
+            "symbols": list(self.symbols) if self.symbols is not None else None,
+            "times": list(self.times) if self.times is not None else None,
+            "frequency_minutes": self.frequency_minutes,
+            "strategy_type": self.strategy_type,
+        }
 
-        return self.symbols or list(SCAN_SYMBOLS)
+    @classmethod
+    def from_dict(cls, entry: dict) -> "TelegramUser":
+        """Inverse of to_dict; the lists are copied so the instance can't alias the row."""
+        user = cls(**entry)
+        if user.symbols is not None:
+            user.symbols = list(user.symbols)
+        if user.times is not None:
+            user.times = list(user.times)
+        return user
 
-    def effective_strategy_symbols(self) -> List[str]:
-        from config import TRADE_SYMBOLS
+    def effective_symbols(self) -> List[str]:
+        return self.symbols or list(config.SCAN_SYMBOLS)
 
+    def effective_strategy_symbols(self) -> List[str]:
         # If the user explicitly chose symbols, use them for strategy too;
         # otherwise fall back to the global strategy universe.
-        return self.symbols or list(TRADE_SYMBOLS)
+        return self.symbols or list(config.TRADE_SYMBOLS)
 
     def effective_strategy_type(self) -> str:
-        from config import SMA_STRATEGY_TYPE
-
-        mode = (self.strategy_type or SMA_STRATEGY_TYPE or "position").lower()
+        mode = (self.strategy_type or config.SMA_STRATEGY_TYPE or "position").lower()
         if mode not in {"scalping", "swing", "position"}:
             return "position"
         return mode
 
     def effective_times(self) -> List[str]:
-        from config import REPORT_TIMES
+        return list(_clean_times(_str_times(self.times or config.REPORT_TIMES)))
 
-        base = self.times or list(REPORT_TIMES)
-        cleaned = [t for t in base if isinstance(t, str) and _is_valid_hhmm(t)]
-        return cleaned or ["08:00", "20:00"]
+    def effective_minutes(self) -> frozenset[int]:
+        """effective_times() as minutes since midnight."""
+        return _times_to_minutes(_clean_times(_str_times(self.times or config.REPORT_TIMES)))
 
 
-def _load_raw() -> Dict[str, dict]:
-    if not USERS_FILE.exists():
-        return {}
-    try:
-        return json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
+def _str_times(times) -> tuple[str, ...]:
+    # Stored rows may hold non-str junk (e.g. nested lists); drop it before it becomes
+    # part of an lru_cache key, where an unhashable element would raise.
+    return tuple(t for t in times if isinstance(t, str))
+
+
+# Users share a handful of distinct time lists, so validate each list only once.
+@lru_cache(maxsize=256)
+def _clean_times(times: tuple[str, ...]) -> tuple[str, ...]:
+    cleaned = tuple(t for t in times if _is_valid_hhmm(t))
+    return cleaned or ("08:00", "20:00")
+
+
+@lru_cache(maxsize=256)
+def _times_to_minutes(times: tuple[str, ...]) -> frozenset[int]:
+    return frozenset(int(t[:2]) * 60 + int(t[3:]) for t in times)
+
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.RLock()
+
+# Parsed users keyed by chat_id, dropped whenever another connection (the other
+# process) commits; PRAGMA data_version detects that cheaply. _version counts every
+# change seen by this process and is what users_version() reports.
+_cache: Dict[int, dict] | None = None
+_data_version: int | None = None
+_version = 0
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        USERS_DB.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit; the scheduler and bot each hold a connection, serialized by _lock
+        # within a process and by SQLite (WAL) across them.
+        conn = sqlite3.connect(USERS_DB, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS users (chat_id INTEGER PRIMARY KEY, json TEXT NOT NULL)")
+        _migrate_legacy_users(conn)
+        _conn = conn
+    return _conn
 
 
-def _save_raw(data: Dict[str, dict]) -> None:
-    USERS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    USERS_FILE.write_text(json.dumps(data, indent=2), encoding="utf-8")
+def _migrate_legacy_users(conn: sqlite3.Connection) -> None:
+    """Import the old JSON users file into the database, once."""
+    if not LEGACY_USERS_FILE.exists():
+        return
+    with conn:
+        # The bot and scheduler may both get here; the write lock serializes them, and
+        # whoever is second finds the file gone (or re-imports it harmlessly).
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            raw = _loads(LEGACY_USERS_FILE.read_bytes())
+        except Exception:  # already migrated by the other process, or unreadable
+            return
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (chat_id, json) VALUES (?, ?)",
+            [(int(k), _dumps(v)) for k, v in raw.items()],
+        )
+    LEGACY_USERS_FILE.unlink(missing_ok=True)
+
+
+def _sync(conn: sqlite3.Connection) -> None:
+    """Invalidate the cache if another connection changed the table."""
+    global _cache, _data_version, _version
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _data_version:
+        _data_version = data_version
+        _cache = None
+        _version += 1
+
+
+def _load_all() -> Dict[int, dict]:
+    global _cache
+    with _lock:
+        conn = _connect()
+        _sync(conn)
+        if _cache is None:
+            _cache = {
+                chat_id: _loads(raw)
+                for chat_id, raw in conn.execute("SELECT chat_id, json FROM users ORDER BY chat_id")
+            }
+        return _cache
+
+
+def users_version() -> int:
+    """Changes whenever the stored users change, in this process or the other one."""
+    with _lock:
+        _sync(_connect())
+        return _version
+
+
+def _get_entry(chat_id: int) -> dict | None:
+    """The stored row for chat_id, or this thread's uncommitted batch row if it has one."""
+    pending = getattr(_batch, "pending", None)
+    if pending and chat_id in pending:
+        return pending[chat_id]
+    return _load_all().get(chat_id)
 
 
 def get_user(chat_id: int) -> TelegramUser | None:
-    data = _load_raw()
-    entry = data.get(str(chat_id))
+    entry = _get_entry(int(chat_id))
     if not entry:
         return None
-    return TelegramUser(**entry)
+    return TelegramUser.from_dict(entry)
+
+
+_UPSERT_SQL = (
+    "INSERT INTO users (chat_id, json) VALUES (?, ?) "
+    "ON CONFLICT(chat_id) DO UPDATE SET json = excluded.json"
+)
+
+# Per-thread users_batch() state: nesting depth and the rows waiting to be written.
+_batch = threading.local()
+
+
+@contextmanager
+def users_batch() -> Iterator[None]:
+    """
+    Defer user writes made by this thread until the outermost batch exits, then write
+    them all in one transaction. This thread's reads inside the batch already see the
+    changes; other threads see them once they have committed.
+    """
+    depth = getattr(_batch, "depth", 0)
+    if depth == 0:
+        _batch.pending = {}
+    _batch.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+        if _batch.depth == 0:
+            pending, _batch.pending = _batch.pending, {}
+            if pending:
+                _write_rows(pending)
+
+
+def _write_rows(rows: Dict[int, dict]) -> None:
+    global _version
+    with _lock:
+        conn = _connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_UPSERT_SQL, [(k, _dumps(v)) for k, v in rows.items()])
+        # Our own commits don't change data_version, so bring the cache up to date here;
+        # a failed write never reaches it.
+        if _cache is not None:
+            _cache.update(rows)
+        _version += 1
+
+
+def _write_entry(chat_id: int, entry: dict) -> None:
+    if getattr(_batch, "depth", 0):
+        _batch.pending[chat_id] = entry
+    else:
+        _write_rows({chat_id: entry})
 
 
 def upsert_user(user: TelegramUser) -> None:
-    data = _load_raw()
-    data[str(user.chat_id)] = asdict(user)
-    _save_raw(data)
+    _write_entry(int(user.chat_id), user.to_dict())
 
 
-def all_users() -> List[TelegramUser]:
-    data = _load_raw()
-    return [TelegramUser(**v) for v in data.values()]
+def set_subscribed(chat_id: int, username: str | None, value: bool) -> None:
+    """Set a user's subscribed flag, creating the user if needed; no-op if unchanged."""
+    with _lock:
+        entry = _get_entry(int(chat_id))
+        if entry is None:
+            entry = TelegramUser(chat_id=chat_id, username=username, subscribed=value).to_dict()
+        elif entry.get("subscribed", True) == value:
+            return
+        else:
+            entry = {**entry, "subscribed": value}
+        _write_entry(int(chat_id), entry)
 
+
+def all_users() -> List[TelegramUser]:
+    entries = _load_all()
+    pending = getattr(_batch, "pending", None)
+    if pending:
+        entries = {**entries, **pending}
+    return [TelegramUser.from_dict(v) for v in entries.values()]